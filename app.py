@@ -6,13 +6,26 @@ Provides a web interface for the CLI functionality in imagegen.py
 
 import os
 import base64
+import functools
+import hmac
+import math
 import tempfile
 import uuid
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, make_response
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from openai import OpenAI, APIError, APIConnectionError, APIStatusError
 import sys
+from hedging import DeadlineExceeded, deadline_client, hedger
+from image_encoding import (
+    api_output_params, file_extension, reencode_images, validate_output_options
+)
+from prompt_templates import (
+    PregenJob, PregenScheduler, PregenStore, TemplateError, cache_key, load_config, render_prompt
+)
+from chunked_uploads import UploadError, UploadStore
+import profiling
+import imagegen
 
 # Load environment variables
 load_dotenv()
@@ -37,11 +50,89 @@ except APIError as e:
     print(f"Error initializing OpenAI client: {e}", file=sys.stderr)
     sys.exit(1)
 
+# Prompt templates and off-peak pre-generation (see prompt_templates.py)
+TEMPLATE_CONFIG = load_config(os.environ.get('IMAGEGEN_TEMPLATES_FILE', 'prompt_templates.json'))
+PROMPT_TEMPLATES = TEMPLATE_CONFIG.get('templates', {})
+pregen_store = PregenStore(OUTPUT_FOLDER)
+pregen_scheduler = PregenScheduler.from_config(TEMPLATE_CONFIG, pregen_store, imagegen.generate_image)
+
+# Opt-in, so a multi-worker deployment can enable it on exactly one process.
+# Under the debug reloader only the serving child process starts it.
+PREGEN_ENABLED = os.environ.get('IMAGEGEN_PREGEN', '').lower() in ('1', 'true', 'yes')
+if PREGEN_ENABLED and PROMPT_TEMPLATES and not (
+    __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+):
+    pregen_scheduler.start()
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# Opt-in request profiling (see profiling.py); only available behind an admin token
+ADMIN_TOKEN = os.environ.get('IMAGEGEN_ADMIN_TOKEN')
+PROFILING_ENABLED = os.environ.get('IMAGEGEN_PROFILING', '').lower() in ('1', 'true', 'yes')
+if PROFILING_ENABLED and not ADMIN_TOKEN:
+    print("IMAGEGEN_PROFILING ignored: IMAGEGEN_ADMIN_TOKEN must be set", file=sys.stderr)
+    PROFILING_ENABLED = False
+
+# Resumable chunked uploads; completed assets can be passed to /edit
+upload_store = UploadStore(UPLOAD_FOLDER, ALLOWED_EXTENSIONS)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_deadline(value):
+    """Parse an optional per-request deadline in seconds; raises ValueError if invalid."""
+    if value in (None, ''):
+        return None
+    try:
+        deadline = float(value)
+    except TypeError:
+        raise ValueError('Deadline must be a number')
+    if not math.isfinite(deadline) or deadline <= 0:
+        raise ValueError('Deadline must be a positive number of seconds')
+    return deadline
+
+def parse_output_options(values):
+    """
+    Read output_format/output_compression/reencode from a JSON dict or form.
+    Returns (output_format, output_compression, reencode); raises ValueError if invalid.
+    """
+    output_format = str(values.get('output_format') or 'png').lower()
+    compression = values.get('output_compression')
+    try:
+        output_compression = int(compression) if compression not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('Output compression must be a valid integer')
+    reencode = str(values.get('reencode', '')).lower() in ('1', 'true', 'on', 'yes')
+    error = validate_output_options(output_format, output_compression, reencode)
+    if error:
+        raise ValueError(error)
+    return output_format, output_compression, reencode
+
+def decode_images(response, output_format, output_compression, reencode):
+    """Decode the b64 payloads, re-encoding on the local worker pool if requested."""
+    images = [base64.b64decode(image_data.b64_json) for image_data in response.data]
+    if reencode:
+        images = reencode_images(images, output_format, output_compression)
+    return images
+
+def profiled(view):
+    """Profile the view when an admin request sends X-Profile."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILING_ENABLED or not request.headers.get('X-Profile') or not admin_allowed():
+            return view(*args, **kwargs)
+        with profiling.profile(view.__name__) as session:
+            resp = make_response(view(*args, **kwargs))
+        resp.headers['X-Profile-Id'] = os.path.basename(session.path)
+        return resp
+    return wrapper
+
+def admin_allowed():
+    if not PROFILING_ENABLED:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -51,6 +142,7 @@ def favicon():
     return '', 204
 
 @app.route('/generate', methods=['POST'])
+@profiled
 def generate_image():
     try:
         data = request.get_json()
@@ -58,6 +150,27 @@ def generate_image():
         size = data.get('size', '1024x1024')
         quality = data.get('quality', 'high')
         n = int(data.get('n', 1))
+        template = data.get('template')
+        template_params = data.get('params') or {}
+        
+        try:
+            deadline = parse_deadline(data.get('deadline'))
+        except ValueError:
+            return jsonify({'error': 'Deadline must be a positive number of seconds'}), 400
+        
+        try:
+            output_format, output_compression, reencode = parse_output_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Templated requests render their prompt from the registered template
+        if template is not None and not isinstance(template, str):
+            return jsonify({'error': 'Template must be a string'}), 400
+        if template:
+            try:
+                prompt = render_prompt(PROMPT_TEMPLATES, template, template_params)
+            except TemplateError as e:
+                return jsonify({'error': str(e)}), 400
         
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
@@ -79,25 +192,66 @@ def generate_image():
         if n < 1 or n > 10:
             return jsonify({'error': 'Number of images must be between 1 and 10'}), 400
         
+        parameters = {
+            'size': size,
+            'quality': quality,
+            'count': n,
+            'deadline': deadline,
+            'output_format': output_format,
+            'output_compression': output_compression,
+            'reencode': reencode,
+            'template': template
+        }
+        
+        # Serve exact matches from the pre-generated store. Stored images are
+        # encoded upstream, so locally re-encoded requests never match.
+        pregenerated = None
+        if not reencode:
+            if template:
+                pregen_scheduler.record(PregenJob.from_request(
+                    template, template_params, size=size, quality=quality, n=n,
+                    output_format=output_format, output_compression=output_compression
+                ))
+            key = cache_key(prompt, size, quality, n, output_format, output_compression)
+            pregenerated = pregen_store.lookup(key, n, output_format)
+        if pregenerated:
+            return jsonify({
+                'success': True,
+                'images': [f'/download/{filename}' for filename in pregenerated],
+                'prompt': prompt,
+                'pregenerated': True,
+                'parameters': parameters
+            })
+        
+        # Ask upstream for PNG when re-encoding locally
+        if reencode:
+            output_params = api_output_params('png', None)
+        else:
+            output_params = api_output_params(output_format, output_compression)
+        
         # Generate image
-        response = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            n=n,
-            moderation="low"
+        response = hedger.call(
+            lambda timeout: deadline_client(client, timeout).images.generate(
+                model="gpt-image-1",
+                prompt=prompt,
+                size=size,
+                quality=quality,
+                n=n,
+                moderation="low",
+                **output_params
+            ),
+            deadline=deadline
         )
         
         # Save generated images
         image_urls = []
-        for i, image_data in enumerate(response.data):
+        images = decode_images(response, output_format, output_compression, reencode)
+        for i, image_bytes in enumerate(images):
             # Generate unique filename
-            filename = f"generated_{uuid.uuid4().hex}_{i}.png"
+            filename = f"generated_{uuid.uuid4().hex}_{i}.{file_extension(output_format)}"
             filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
             
-            # Download and save image
-            image_bytes = base64.b64decode(image_data.b64_json)
+            # Save image
             with open(filepath, 'wb') as f:
                 f.write(image_bytes)
             
@@ -107,31 +261,43 @@ def generate_image():
             'success': True,
             'images': image_urls,
             'prompt': prompt,
-            'parameters': {
-                'size': size,
-                'quality': quality,
-                'count': n
-            }
+            'pregenerated': False,
+            'parameters': parameters
         })
         
+    except DeadlineExceeded as e:
+        return jsonify({'error': f'Deadline exceeded: {str(e)}'}), 504
     except APIError as e:
         return jsonify({'error': f'OpenAI API error: {str(e)}'}), 500
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @app.route('/edit', methods=['POST'])
+@profiled
 def edit_image():
     try:
-        # Check if image file is provided
-        if 'image' not in request.files:
-            return jsonify({'error': 'Image file is required'}), 400
-        
-        image_file = request.files['image']
-        if image_file.filename == '':
-            return jsonify({'error': 'No image selected'}), 400
+        # Assets from a completed chunked upload replace the multipart files
+        image_path = None
+        mask_path = None
+        try:
+            if request.form.get('image_asset_id'):
+                image_path = upload_store.asset_path(request.form['image_asset_id'])
+            if request.form.get('mask_asset_id'):
+                mask_path = upload_store.asset_path(request.form['mask_asset_id'])
+        except UploadError as e:
+            return jsonify({'error': str(e)}), e.status
         
-        if not allowed_file(image_file.filename):
-            return jsonify({'error': 'Invalid file type. Allowed: PNG, JPG, JPEG, GIF'}), 400
+        if image_path is None:
+            # Check if image file is provided
+            if 'image' not in request.files:
+                return jsonify({'error': 'Image file is required'}), 400
+            
+            image_file = request.files['image']
+            if image_file.filename == '':
+                return jsonify({'error': 'No image selected'}), 400
+            
+            if not allowed_file(image_file.filename):
+                return jsonify({'error': 'Invalid file type. Allowed: PNG, JPG, JPEG, GIF'}), 400
         
         # Get form data
         prompt = request.form.get('prompt', '').strip()
@@ -146,6 +312,16 @@ def edit_image():
             
         input_fidelity = request.form.get('input_fidelity', None)
         
+        try:
+            deadline = parse_deadline(request.form.get('deadline'))
+        except ValueError:
+            return jsonify({'error': 'Deadline must be a positive number of seconds'}), 400
+        
+        try:
+            output_format, output_compression, reencode = parse_output_options(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
         if not prompt:
             return jsonify({'error': 'Prompt is required'}), 400
         
@@ -169,13 +345,15 @@ def edit_image():
         
         try:
             # Save uploaded image
-            filename = secure_filename(image_file.filename)
-            temp_filename = f"temp_{uuid.uuid4().hex}_{filename}"
-            temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-            image_file.save(temp_filepath)
+            if image_path is None:
+                filename = secure_filename(image_file.filename)
+                temp_filename = f"temp_{uuid.uuid4().hex}_{filename}"
+                temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
+                image_file.save(temp_filepath)
+                image_path = temp_filepath
             
             # Handle mask file if provided
-            if 'mask' in request.files and request.files['mask'].filename != '':
+            if mask_path is None and 'mask' in request.files and request.files['mask'].filename != '':
                 mask_file = request.files['mask']
                 if not allowed_file(mask_file.filename):
                     return jsonify({'error': 'Invalid mask file type. Allowed: PNG, JPG, JPEG, GIF'}), 400
@@ -184,61 +362,77 @@ def edit_image():
                 temp_mask_filename = f"mask_{uuid.uuid4().hex}_{mask_filename}"
                 mask_filepath = os.path.join(app.config['UPLOAD_FOLDER'], temp_mask_filename)
                 mask_file.save(mask_filepath)
+                mask_path = mask_filepath
             
-            with open(temp_filepath, 'rb') as img_file:
-                mask_file_obj = None
-                if mask_filepath:
-                    mask_file_obj = open(mask_filepath, 'rb')
-                
-                try:
-                    # Edit image
-                    edit_params = {
-                        "model": "gpt-image-1",
-                        "image": img_file,
-                        "prompt": prompt,
-                        "n": n,
-                        "size": size,
-                        "quality": quality,
-                        }
-                    
-                    # Add optional parameters
-                    if mask_file_obj:
-                        edit_params["mask"] = mask_file_obj
-                    if input_fidelity in ("low", "high"):
-                        edit_params["input_fidelity"] = input_fidelity
-                    
-                    response = client.images.edit(**edit_params)
+            # Ask upstream for PNG when re-encoding locally
+            if reencode:
+                output_params = api_output_params('png', None)
+            else:
+                output_params = api_output_params(output_format, output_compression)
+            
+            def call_edit(timeout):
+                # Each attempt opens its own handles so a hedged duplicate
+                # never shares file positions with the original request
+                with open(image_path, 'rb') as img_file:
+                    mask_file_obj = None
+                    if mask_path:
+                        mask_file_obj = open(mask_path, 'rb')
                     
-                    # Save edited images
-                    image_urls = []
-                    for i, image_data in enumerate(response.data):
-                        # Generate unique filename
-                        output_filename = f"edited_{uuid.uuid4().hex}_{i}.png"
-                        output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+                    try:
+                        # Edit image
+                        edit_params = {
+                            "model": "gpt-image-1",
+                            "image": img_file,
+                            "prompt": prompt,
+                            "n": n,
+                            "size": size,
+                            "quality": quality,
+                            }
                         
-                        # Download and save image
-                        image_bytes = base64.b64decode(image_data.b64_json)
-                        with open(output_filepath, 'wb') as f:
-                            f.write(image_bytes)
+                        # Add optional parameters
+                        if mask_file_obj:
+                            edit_params["mask"] = mask_file_obj
+                        if input_fidelity in ("low", "high"):
+                            edit_params["input_fidelity"] = input_fidelity
+                        edit_params.update(output_params)
                         
-                        image_urls.append(f'/download/{output_filename}')
-                    
-                    resp = jsonify({
-                        'success': True,
-                        'images': image_urls,
-                        'prompt': prompt,
-                        'parameters': {
-                            'size': size,
-                            'quality': quality,
-                            'count': n,
-                            'had_mask': mask_filepath is not None,
-                            'input_fidelity': input_fidelity
-                        }
-                    })
-                    
-                finally:
-                    if mask_file_obj:
-                        mask_file_obj.close()
+                        return deadline_client(client, timeout).images.edit(**edit_params)
+                    finally:
+                        if mask_file_obj:
+                            mask_file_obj.close()
+            
+            response = hedger.call(call_edit, deadline=deadline)
+            
+            # Save edited images
+            image_urls = []
+            images = decode_images(response, output_format, output_compression, reencode)
+            for i, image_bytes in enumerate(images):
+                # Generate unique filename
+                output_filename = f"edited_{uuid.uuid4().hex}_{i}.{file_extension(output_format)}"
+                output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+                
+                # Save image
+                with open(output_filepath, 'wb') as f:
+                    f.write(image_bytes)
+                
+                image_urls.append(f'/download/{output_filename}')
+            
+            resp = jsonify({
+                'success': True,
+                'images': image_urls,
+                'prompt': prompt,
+                'parameters': {
+                    'size': size,
+                    'quality': quality,
+                    'count': n,
+                    'had_mask': mask_path is not None,
+                    'input_fidelity': input_fidelity,
+                    'deadline': deadline,
+                    'output_format': output_format,
+                    'output_compression': output_compression,
+                    'reencode': reencode
+                }
+            })
         
         finally:
             # Clean up temporary files no matter what
@@ -252,6 +446,9 @@ def edit_image():
         
         return resp
             
+    except DeadlineExceeded as e:
+        print(f"Deadline exceeded in edit: {e}", file=sys.stderr)
+        return jsonify({'error': f'Deadline exceeded: {str(e)}'}), 504
     except APIError as e:
         print(f"OpenAI API Error in edit: {e}", file=sys.stderr)
         return jsonify({'error': f'OpenAI API error: {str(e)}'}), 500
@@ -261,6 +458,79 @@ def edit_image():
         traceback.print_exc()
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+@app.route('/uploads', methods=['POST'])
+def init_upload():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    if not isinstance(filename, str):
+        return jsonify({'error': 'Filename must be a string'}), 400
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Upload size must be a valid integer'}), 400
+    try:
+        return jsonify(upload_store.init(secure_filename(filename), size)), 201
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.extra}), e.status
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        return jsonify(upload_store.status(upload_id))
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.extra}), e.status
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+def append_upload_chunk(upload_id):
+    checksum = request.headers.get('X-Chunk-SHA256', '')
+    if not checksum:
+        return jsonify({'error': 'X-Chunk-SHA256 header is required'}), 400
+    try:
+        offset = int(request.headers.get('X-Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'X-Upload-Offset header must be a valid integer'}), 400
+    try:
+        # Stream the body to disk rather than buffering the whole chunk
+        return jsonify(upload_store.append(upload_id, offset, checksum, request.stream))
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.extra}), e.status
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    data = request.get_json(silent=True) or {}
+    checksum = data.get('sha256')
+    if checksum is not None and not isinstance(checksum, str):
+        return jsonify({'error': 'sha256 must be a string'}), 400
+    try:
+        return jsonify(upload_store.complete(upload_id, checksum))
+    except UploadError as e:
+        return jsonify({'error': str(e), **e.extra}), e.status
+
+@app.route('/templates')
+def list_templates():
+    return jsonify({'templates': PROMPT_TEMPLATES})
+
+@app.route('/hedge-stats')
+def hedge_stats():
+    return jsonify(hedger.stats())
+
+@app.route('/admin/profiles')
+def list_profiles():
+    if not admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'profiles': profiling.list_profiles()})
+
+@app.route('/admin/profiles/<filename>')
+def download_profile(filename):
+    if not admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    # Secure the filename to prevent directory traversal
+    safe_filename = secure_filename(filename)
+    filepath = os.path.join(profiling.PROFILE_FOLDER, safe_filename)
+    if not safe_filename.endswith(profiling.PROFILE_EXTENSION) or not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    return send_file(filepath, as_attachment=True, mimetype='text/plain')
+
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
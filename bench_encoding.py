@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the size/latency tradeoff of the output formats.
+
+Re-encodes one or more PNGs (e.g. images saved by imagegen.py or app.py) to
+every supported format and compression level, and reports the encoded size,
+the reduction versus the original and the encode time per image. Also times
+a batch through the re-encode worker pool to show its parallel speed-up.
+
+Requires Pillow (pip install pillow).
+
+Usage examples
+--------------
+python bench_encoding.py outputs/generated_*.png
+python bench_encoding.py input.png --compression 100 80 50 --repeat 5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+from image_encoding import LOSSY_FORMATS, OUTPUT_FORMATS, reencode_image, reencode_images
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="bench_encoding.py",
+        description="Compare output size and encode latency across formats.",
+    )
+    parser.add_argument("images", nargs="+", help="PNG files to re-encode.")
+    parser.add_argument(
+        "--compression", type=int, nargs="+", default=[100, 85, 70, 50],
+        help="Compression levels to test for jpeg/webp (0-100)."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Encodes per image and setting.")
+    return parser.parse_args()
+
+
+def bench_setting(images: List[bytes], output_format: str, compression, repeat: int) -> dict:
+    sizes, timings = [], []
+    for img in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            out = reencode_image(img, output_format, compression)
+            timings.append(time.perf_counter() - start)
+        sizes.append(len(out))
+    return {"size": statistics.mean(sizes), "ms": statistics.median(timings) * 1000}
+
+
+def main() -> None:
+    args = parse_args()
+    images = []
+    for path in args.images:
+        if not os.path.exists(path):
+            print(f"Error: Image file not found at '{path}'", file=sys.stderr)
+            sys.exit(1)
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    original = statistics.mean(len(img) for img in images)
+    print(f"{len(images)} image(s), mean original size {original / 1024:.0f} KiB")
+    print("-" * 56)
+    print(f"{'format':<8}{'compression':>12}{'size KiB':>12}{'vs orig':>10}{'encode ms':>14}")
+    for output_format in OUTPUT_FORMATS:
+        levels = args.compression if output_format in LOSSY_FORMATS else [None]
+        for level in levels:
+            result = bench_setting(images, output_format, level, args.repeat)
+            print(
+                f"{output_format:<8}{'-' if level is None else level:>12}"
+                f"{result['size'] / 1024:>12.0f}{result['size'] / original:>10.0%}{result['ms']:>14.1f}"
+            )
+    print("-" * 56)
+
+    # Batch through the worker pool vs. one after another
+    batch = images * 4
+    start = time.perf_counter()
+    for img in batch:
+        reencode_image(img, "webp", 80)
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    reencode_images(batch, "webp", 80)
+    pooled = time.perf_counter() - start
+    print(f"webp@80 batch of {len(batch)}: serial {serial * 1000:.0f} ms, "
+          f"worker pool {pooled * 1000:.0f} ms ({serial / pooled:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Resumable, checksummed chunked uploads for /edit.
+
+Protocol (all routes live in app.py):
+
+1. POST /uploads                      {"filename": "photo.png", "size": 12345678}
+                                      -> {"upload_id": ..., "offset": 0, "chunk_size": ...}
+2. PUT  /uploads/<upload_id>          raw chunk bytes, with headers
+                                      X-Upload-Offset: <byte offset of this chunk>
+                                      X-Chunk-SHA256:  <hex digest of this chunk>
+                                      -> {"offset": <bytes received so far>}
+3. POST /uploads/<upload_id>/complete {"sha256": <optional hex digest of the whole file>}
+                                      -> {"asset_id": ...}
+
+GET /uploads/<upload_id> reports the current offset, so an interrupted client
+resumes from there instead of starting over. Chunks are streamed straight to
+disk and a chunk whose checksum does not match is discarded. The asset id can
+then be passed to /edit as ``image_asset_id`` / ``mask_asset_id``.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, Optional
+
+CHUNK_SIZE = 4 * 1024 * 1024  # advertised chunk size, below MAX_CONTENT_LENGTH
+READ_BLOCK = 64 * 1024
+
+
+class UploadError(Exception):
+    """Upload protocol error; ``status`` is the HTTP status to return."""
+
+    def __init__(self, message: str, status: int = 400, **extra: Any):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class UploadStore:
+    """
+    Upload sessions and completed assets on local disk.
+
+    Sessions live in ``<folder>/chunked/<upload_id>/`` (``meta.json`` plus
+    ``data.part``); completed assets are moved to ``<folder>/assets/``.
+    Sessions and assets older than ``ttl`` seconds are purged.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        allowed_extensions,
+        max_size: int = 50 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+    ):
+        self.sessions_folder = os.path.join(folder, "chunked")
+        self.assets_folder = os.path.join(folder, "assets")
+        self.allowed_extensions = set(allowed_extensions)
+        self.max_size = max_size
+        self.ttl = ttl
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(self.sessions_folder, exist_ok=True)
+        os.makedirs(self.assets_folder, exist_ok=True)
+
+    # --- Helpers ---
+
+    def _lock(self, upload_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _session_dir(self, upload_id: str) -> str:
+        # Ids are uuid hex; reject anything else to prevent path traversal
+        if not (len(upload_id) == 32 and all(c in "0123456789abcdef" for c in upload_id)):
+            raise UploadError("Upload not found", 404)
+        return os.path.join(self.sessions_folder, upload_id)
+
+    def _load_meta(self, upload_id: str) -> Dict[str, Any]:
+        meta_path = os.path.join(self._session_dir(upload_id), "meta.json")
+        if not os.path.exists(meta_path):
+            raise UploadError("Upload not found", 404)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_meta(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        meta_path = os.path.join(self._session_dir(upload_id), "meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def purge_expired(self) -> None:
+        cutoff = time.time() - self.ttl
+        for folder in (self.sessions_folder, self.assets_folder):
+            for name in os.listdir(folder):
+                path = os.path.join(folder, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        if os.path.isdir(path):
+                            shutil.rmtree(path, ignore_errors=True)
+                            # Session directories are named by upload id
+                            with self._locks_guard:
+                                self._locks.pop(name, None)
+                        else:
+                            os.remove(path)
+                except OSError:
+                    pass
+
+    # --- Protocol ---
+
+    def init(self, filename: str, size: int) -> Dict[str, Any]:
+        """Start an upload session for a file of ``size`` bytes."""
+        if "." not in filename or filename.rsplit(".", 1)[1].lower() not in self.allowed_extensions:
+            raise UploadError(
+                f"Invalid file type. Allowed: {', '.join(sorted(self.allowed_extensions)).upper()}"
+            )
+        if not 0 < size <= self.max_size:
+            raise UploadError(f"Upload size must be between 1 and {self.max_size} bytes")
+
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._session_dir(upload_id))
+        open(os.path.join(self._session_dir(upload_id), "data.part"), "wb").close()
+        meta = {
+            "filename": filename,
+            "extension": filename.rsplit(".", 1)[1].lower(),
+            "size": size,
+            "offset": 0,
+        }
+        self._save_meta(upload_id, meta)
+        return {"upload_id": upload_id, "offset": 0, "size": size, "chunk_size": CHUNK_SIZE}
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        meta = self._load_meta(upload_id)
+        return {"upload_id": upload_id, "offset": meta["offset"], "size": meta["size"]}
+
+    def append(self, upload_id: str, offset: int, checksum: str, stream: BinaryIO) -> Dict[str, Any]:
+        """
+        Stream one chunk from ``stream`` to disk at ``offset``.
+
+        The chunk is only kept if its SHA-256 matches ``checksum``; otherwise
+        the partial file is truncated back and the client may retry.
+        """
+        self._load_meta(upload_id)  # unknown ids must not leave a lock behind
+        with self._lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if offset != meta["offset"]:
+                raise UploadError("Offset does not match bytes received", 409, offset=meta["offset"])
+
+            data_path = os.path.join(self._session_dir(upload_id), "data.part")
+            digest = hashlib.sha256()
+            written = 0
+            with open(data_path, "r+b") as f:
+                f.seek(offset)
+                try:
+                    while True:
+                        block = stream.read(READ_BLOCK)
+                        if not block:
+                            break
+                        written += len(block)
+                        if offset + written > meta["size"]:
+                            raise UploadError("Chunk exceeds declared upload size", 413, offset=offset)
+                        digest.update(block)
+                        f.write(block)
+                    if written == 0:
+                        raise UploadError("Empty chunk", offset=offset)
+                    if digest.hexdigest() != checksum.lower():
+                        raise UploadError("Chunk checksum mismatch", 422, offset=offset)
+                except BaseException:
+                    # Drop the partial chunk (including client disconnects)
+                    f.truncate(offset)
+                    raise
+
+            meta["offset"] = offset + written
+            self._save_meta(upload_id, meta)
+            return {"upload_id": upload_id, "offset": meta["offset"], "size": meta["size"]}
+
+    def complete(self, upload_id: str, checksum: Optional[str] = None) -> Dict[str, Any]:
+        """Verify the assembled file and turn it into an asset usable by /edit."""
+        self._load_meta(upload_id)  # unknown ids must not leave a lock behind
+        with self._lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if meta["offset"] != meta["size"]:
+                raise UploadError("Upload is incomplete", 409, offset=meta["offset"])
+
+            session_dir = self._session_dir(upload_id)
+            data_path = os.path.join(session_dir, "data.part")
+            if checksum:
+                digest = hashlib.sha256()
+                with open(data_path, "rb") as f:
+                    for block in iter(lambda: f.read(READ_BLOCK), b""):
+                        digest.update(block)
+                if digest.hexdigest() != checksum.lower():
+                    raise UploadError("File checksum mismatch", 422)
+
+            asset_id = upload_id
+            os.replace(data_path, os.path.join(self.assets_folder, f"{asset_id}.{meta['extension']}"))
+            shutil.rmtree(session_dir, ignore_errors=True)
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+        return {"asset_id": asset_id, "size": meta["size"], "filename": meta["filename"]}
+
+    def asset_path(self, asset_id: str) -> str:
+        """Return the on-disk path of a completed asset."""
+        self._session_dir(asset_id)  # validates the id format
+        for extension in self.allowed_extensions:
+            path = os.path.join(self.assets_folder, f"{asset_id}.{extension}")
+            if os.path.exists(path):
+                return path
+        raise UploadError("Asset not found", 404)
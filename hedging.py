@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Hedged requests and per-call deadlines for OpenAI image calls.
+
+Shared by imagegen.py and app.py. Without hedging or a deadline a call runs
+directly on the caller's thread. Otherwise each attempt gets its own daemon
+thread; if it is still outstanding after a configurable percentile of recent
+latencies, a duplicate is fired and whichever finishes first wins. Hedges are
+capped to a fraction of all calls so slow periods do not double the API spend.
+
+Environment variables
+---------------------
+IMAGEGEN_HEDGE=1                 Enable hedging (off by default).
+IMAGEGEN_HEDGE_PERCENTILE=95     Latency percentile that triggers a hedge.
+IMAGEGEN_HEDGE_MAX_RATE=0.1      Maximum fraction of calls that may be hedged.
+IMAGEGEN_HEDGE_AFTER=<seconds>   Fixed hedge delay used until enough samples exist.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from profiling import propagate
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call does not complete before its deadline."""
+
+
+def deadline_client(client, timeout: Optional[float]):
+    """
+    Return the OpenAI client to use for an attempt with ``timeout`` seconds left.
+
+    With a deadline in effect the SDK's own retries are disabled, since each
+    retry would otherwise get the full remaining budget again.
+    """
+    if timeout is None:
+        return client
+    return client.with_options(max_retries=0, timeout=timeout)
+
+
+class Hedger:
+    """
+    Run callables with an optional deadline and latency-based hedging.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether duplicate requests may be fired at all.
+    percentile : float
+        Percentile (0-100) of recent latencies after which a call is hedged.
+    max_hedge_rate : float
+        Upper bound on hedged calls / total calls.
+    min_samples : int
+        Latency samples required before the percentile is trusted.
+    window : int
+        Number of recent latencies kept.
+    hedge_after : float, optional
+        Fixed hedge delay in seconds used while fewer than ``min_samples``
+        latencies have been recorded (e.g. for one-shot CLI runs).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        max_hedge_rate: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        hedge_after: Optional[float] = None,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.hedge_after = hedge_after
+        self._latencies = deque(maxlen=window)
+        self._calls = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Hedger":
+        hedge_after = os.environ.get("IMAGEGEN_HEDGE_AFTER")
+        return cls(
+            enabled=os.environ.get("IMAGEGEN_HEDGE", "").lower() in ("1", "true", "yes"),
+            percentile=float(os.environ.get("IMAGEGEN_HEDGE_PERCENTILE", 95)),
+            max_hedge_rate=float(os.environ.get("IMAGEGEN_HEDGE_MAX_RATE", 0.1)),
+            hedge_after=float(hedge_after) if hedge_after else None,
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """Return the current hedge delay in seconds, or None if hedging is off."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.hedge_after
+        # Nearest-rank percentile
+        rank = max(int(round(self.percentile / 100.0 * len(samples))) - 1, 0)
+        return samples[min(rank, len(samples) - 1)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls, hedges, wins = self._calls, self._hedges, self._hedge_wins
+            samples = len(self._latencies)
+        return {
+            "enabled": self.enabled,
+            "calls": calls,
+            "hedged": hedges,
+            "hedge_wins": wins,
+            "hedge_rate": hedges / calls if calls else 0.0,
+            "max_hedge_rate": self.max_hedge_rate,
+            "hedge_delay": self.hedge_delay(),
+            "latency_samples": samples,
+        }
+
+    def _claim_hedge(self) -> bool:
+        with self._lock:
+            if self._hedges >= self.max_hedge_rate * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _start(self, attempt: Callable[[], T]) -> "Future[T]":
+        # A daemon thread per attempt: no shared concurrency limit, and
+        # attempts abandoned at the deadline never block interpreter exit.
+        future: "Future[T]" = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(attempt())
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="imagegen-call", daemon=True).start()
+        return future
+
+    def call(self, fn: Callable[[Optional[float]], T], deadline: Optional[float] = None) -> T:
+        """
+        Run ``fn`` and return its result, hedging and enforcing ``deadline``.
+
+        ``fn`` receives the remaining time budget in seconds (None when no
+        deadline is set) and should make its SDK call through
+        :func:`deadline_client`. Every attempt must be safe to run concurrently,
+        so it has to open its own file handles.
+
+        Raises
+        ------
+        DeadlineExceeded
+            If no attempt succeeds within ``deadline`` seconds.
+        """
+        start = time.monotonic()
+        expires = start + deadline if deadline is not None else None
+
+        def remaining() -> Optional[float]:
+            return None if expires is None else max(expires - time.monotonic(), 0.0)
+
+        def attempt() -> T:
+            t0 = time.monotonic()
+            result = fn(remaining())
+            with self._lock:
+                self._latencies.append(time.monotonic() - t0)
+            return result
+
+        with self._lock:
+            self._calls += 1
+
+        delay = self.hedge_delay()
+        if delay is None and expires is None:
+            # Nothing to race against: run on the caller's thread
+            return attempt()
+
+        # Sample the worker threads as part of the caller's profile, if any
+        attempt = propagate(attempt)
+
+        hedge_at = start + delay if delay is not None else None
+        primary = self._start(attempt)
+        pending = {primary}
+        error: Optional[BaseException] = None
+
+        while pending:
+            now = time.monotonic()
+            waits = [t - now for t in (expires, hedge_at) if t is not None]
+            timeout = max(min(waits), 0.0) if waits else None
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+
+            now = time.monotonic()
+            if expires is not None and now >= expires and pending:
+                # Outstanding attempts are abandoned on their daemon threads;
+                # the SDK timeout (without retries) bounds them.
+                raise DeadlineExceeded(f"Request did not complete within {deadline:g}s deadline.")
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if pending and self._claim_hedge():
+                    pending.add(self._start(attempt))
+
+        raise error
+
+
+# Process-wide instance used by the CLI and the web app
+hedger = Hedger.from_env()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Output format helpers and the optional local re-encode stage.
+
+gpt-image-1 can return PNG, JPEG or WebP directly (``output_format``) with a
+0-100 ``output_compression`` level for the lossy formats. Alternatively the
+API can be asked for PNG and the bytes re-encoded here, which keeps a lossless
+original on the wire and moves the encode cost onto a local worker pool.
+
+Local re-encoding requires Pillow:
+
+    pip install pillow
+"""
+
+import importlib.util
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from profiling import propagate
+
+OUTPUT_FORMATS = ("png", "jpeg", "webp")
+LOSSY_FORMATS = ("jpeg", "webp")
+
+# Pillow releases the GIL while encoding, so threads scale across cores
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("IMAGEGEN_REENCODE_WORKERS", os.cpu_count() or 2)),
+    thread_name_prefix="imagegen-encode",
+)
+
+
+def file_extension(output_format: str) -> str:
+    """Return the file extension used when saving ``output_format``."""
+    return "jpg" if output_format == "jpeg" else output_format
+
+
+def reencode_available() -> bool:
+    """Whether Pillow is installed, so local re-encoding can work."""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def validate_output_options(
+    output_format: str, output_compression: Optional[int], reencode: bool = False
+) -> Optional[str]:
+    """
+    Return an error message if the output options are invalid, else None.
+
+    Checked before the API call so a missing Pillow does not waste a paid
+    generation whose result would then be thrown away.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        return f"Output format must be one of: {list(OUTPUT_FORMATS)}"
+    if output_compression is not None:
+        if not 0 <= output_compression <= 100:
+            return "Output compression must be between 0 and 100"
+        if output_format not in LOSSY_FORMATS:
+            return "Output compression is only supported for jpeg and webp"
+    if reencode and not reencode_available():
+        return "Local re-encoding requires Pillow (pip install pillow)"
+    return None
+
+
+def api_output_params(output_format: str, output_compression: Optional[int]) -> Dict[str, Any]:
+    """Build the ``output_format``/``output_compression`` kwargs for the Images API."""
+    params: Dict[str, Any] = {"output_format": output_format}
+    if output_compression is not None and output_format in LOSSY_FORMATS:
+        params["output_compression"] = output_compression
+    return params
+
+
+def reencode_image(image_bytes: bytes, output_format: str, output_compression: Optional[int] = None) -> bytes:
+    """
+    Re-encode a single image to ``output_format``.
+
+    ``output_compression`` follows the API's 0-100 scale and is used as the
+    Pillow quality setting for JPEG and WebP (default 100, as upstream).
+    """
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError("Local re-encoding requires Pillow (pip install pillow)") from e
+
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        save_params: Dict[str, Any] = {}
+        if output_format in LOSSY_FORMATS:
+            save_params["quality"] = 100 if output_compression is None else output_compression
+        if output_format == "jpeg" and img.mode not in ("RGB", "L"):
+            # JPEG has no alpha channel
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format=output_format.upper(), **save_params)
+        return out.getvalue()
+
+
+def reencode_images(
+    images: List[bytes], output_format: str, output_compression: Optional[int] = None
+) -> List[bytes]:
+    """Re-encode a batch of images in parallel on the shared worker pool."""
+    encode = propagate(reencode_image)
+    futures = [
+        _executor.submit(encode, img, output_format, output_compression) for img in images
+    ]
+    return [f.result() for f in futures]
@@ -39,12 +39,18 @@ import argparse
 import base64
 from dotenv import load_dotenv
 load_dotenv()  # Load variables from .env so OPENAI_API_KEY is available
+import math
 import os
 import re
 from openai import OpenAI, APIError, APIConnectionError, APIStatusError
 from contextlib import ExitStack # Needed for safely opening multiple files
 import sys # For stderr and exit
 from typing import List, Optional, Union # For type annotations
+from hedging import DeadlineExceeded, deadline_client, hedger
+from profiling import profile
+from image_encoding import (
+    OUTPUT_FORMATS, api_output_params, file_extension, reencode_images, validate_output_options
+)
 
 # Initialize OpenAI client globally (uses OPENAI_API_KEY from environment)
 # Handle potential error if key is missing
@@ -61,13 +67,20 @@ def generate_image(
     size: str = "1024x1024",
     quality: str = "high",
     n: int = 1,
-    moderation: str = "low" # Default moderation level,
+    moderation: str = "low", # Default moderation level
+    deadline: Optional[float] = None, # Hard limit in seconds for the whole call
+    output_format: str = "png", # "png", "jpeg" or "webp"
+    output_compression: Optional[int] = None, # 0-100, jpeg/webp only
+    reencode: bool = False # Request PNG and re-encode locally instead
 ) -> Optional[List[bytes]]:
     """
     Generate one or more images using OpenAI gpt-image-1.
 
     Parameters refer to the 'images.generate' endpoint documentation.
     Note: 'moderation' is specific to generate.
+    'deadline' bounds the call including any hedged duplicate (see hedging.py).
+    With 'reencode', the API returns PNG and the images are converted to
+    'output_format' on the local worker pool (see image_encoding.py).
     """
     allowed_sizes = {"1024x1024", "1024x1536", "1536x1024"}
     if size not in allowed_sizes:
@@ -83,19 +96,38 @@ def generate_image(
         print(f"Error: Number of images must be between 1 and 10, got {n}.", file=sys.stderr)
         return None
 
+    output_error = validate_output_options(output_format, output_compression, reencode)
+    if output_error:
+        print(f"Error: {output_error}.", file=sys.stderr)
+        return None
+    if reencode:
+        output_params = api_output_params("png", None)
+    else:
+        output_params = api_output_params(output_format, output_compression)
+
     print(f"Generating image with model gpt-image-1...")
     try:
-        response = client.images.generate(
-            model="gpt-image-1",
-            prompt=prompt,
-            size=size,
-            quality=quality,
-            n=n,
-            moderation=moderation,
-            response_format="b64_json",
+        response = hedger.call(
+            lambda timeout: deadline_client(client, timeout).images.generate(
+                model="gpt-image-1",
+                prompt=prompt,
+                size=size,
+                quality=quality,
+                n=n,
+                moderation=moderation,
+                response_format="b64_json",
+                **output_params,
+            ),
+            deadline=deadline,
         )
         print("Image generation complete.")
-        return [base64.b64decode(d.b64_json) for d in response.data]
+        images = [base64.b64decode(d.b64_json) for d in response.data]
+        if reencode:
+            images = reencode_images(images, output_format, output_compression)
+        return images
+    except DeadlineExceeded as e:
+        print(f"\nDeadline exceeded during image generation: {e}", file=sys.stderr)
+        return None
     except APIStatusError as e:
         if e.status_code == 429:
             print(f"\nRate limit exceeded. Please wait and try again later.", file=sys.stderr)
@@ -117,13 +149,20 @@ def edit_image(
     quality: str = "high", # Note: DALL-E 2 only supports 'standard'
     n: int = 1,
     model: str = "gpt-image-1", # Can be "dall-e-2" as well for edits
-    input_fidelity: Optional[str] = None # New parameter for high-fidelity preservation
+    input_fidelity: Optional[str] = None, # New parameter for high-fidelity preservation
+    deadline: Optional[float] = None, # Hard limit in seconds for the whole call
+    output_format: str = "png", # "png", "jpeg" or "webp"
+    output_compression: Optional[int] = None, # 0-100, jpeg/webp only
+    reencode: bool = False # Request PNG and re-encode locally instead
 ) -> Optional[List[bytes]]:
     """
     Edit an image or generate based on reference images using OpenAI gpt-image-1 or dall-e-2.
 
     Parameters refer to the 'images.edit' endpoint documentation.
     Accepts one or more image paths. Mask is only used if exactly one image path is provided.
+    'deadline' bounds the call including any hedged duplicate (see hedging.py).
+    Output format options behave as in generate_image(); dall-e-2 always
+    returns PNG, so other formats are produced by re-encoding locally.
     """
     if not image_paths:
         print("Error: No image paths provided for editing.", file=sys.stderr)
@@ -155,12 +194,24 @@ def edit_image(
          if quality != "standard":
               print(f"Warning: Quality '{quality}' ignored. DALL-E 2 only supports 'standard'.", file=sys.stderr)
               quality = "standard"
+         if output_format != "png" and not reencode:
+              print("Warning: dall-e-2 only returns PNG; re-encoding locally.", file=sys.stderr)
+              reencode = True
 
+    output_error = validate_output_options(output_format, output_compression, reencode)
+    if output_error:
+        print(f"Error: {output_error}.", file=sys.stderr)
+        return None
 
-    opened_mask_file = None
-    opened_image_files = []
+    if effective_mask_path:
+        print(f"Using mask '{os.path.basename(effective_mask_path)}'")
+
+    def _call_edit(timeout: Optional[float]):
+        # Each attempt opens its own handles so a hedged duplicate
+        # never shares file positions with the original request.
+        opened_mask_file = None
+        opened_image_files = []
 
-    try:
         # Use ExitStack to safely manage opening multiple files
         with ExitStack() as stack:
             # Open all image files
@@ -170,7 +221,6 @@ def edit_image(
 
             # Open mask file only if path is provided and it's not multi-image mode
             if effective_mask_path:
-                print(f"Using mask '{os.path.basename(effective_mask_path)}'")
                 opened_mask_file = stack.enter_context(open(effective_mask_path, "rb"))
 
             # --- Prepare Parameters and Make the API Call ---
@@ -187,16 +237,26 @@ def edit_image(
                 api_params["mask"] = opened_mask_file
             if model == "gpt-image-1" and input_fidelity in ("low", "high"):
                 api_params["input_fidelity"] = input_fidelity
+            if model == "gpt-image-1":
+                if reencode:
+                    api_params.update(api_output_params("png", None))
+                else:
+                    api_params.update(api_output_params(output_format, output_compression))
 
             # Make the call using dictionary unpacking
-            response = client.images.edit(**api_params)
+            return deadline_client(client, timeout).images.edit(**api_params)
             # -------------------------------------------------
 
+    try:
+        response = hedger.call(_call_edit, deadline=deadline)
         print("Image editing/generation complete.")
 
         # Process response
         if response.data and response.data[0].b64_json:
-            return [base64.b64decode(d.b64_json) for d in response.data]
+            images = [base64.b64decode(d.b64_json) for d in response.data]
+            if reencode:
+                images = reencode_images(images, output_format, output_compression)
+            return images
         elif response.data and response.data[0].url:
             # Handle URL case if needed in the future (e.g., download the image)
             print("Received URL instead of b64_json (likely DALL-E 2 default). Returning None.", file=sys.stderr)
@@ -209,6 +269,9 @@ def edit_image(
     except FileNotFoundError as e:
         print(f"\nError: Input file not found - {e}", file=sys.stderr)
         return None
+    except DeadlineExceeded as e:
+        print(f"\nDeadline exceeded during image editing/generation: {e}", file=sys.stderr)
+        return None
     except APIStatusError as e:
         if e.status_code == 429:
             print(f"\nRate limit exceeded. Please wait and try again later.", file=sys.stderr)
@@ -279,14 +342,66 @@ def parse_args() -> argparse.Namespace:
         "-n", "--num", type=int, default=1,
         help="Number of images to create (max 10)."
     )
+
+    # --- Output Encoding Arguments ---
+    parser.add_argument(
+        "--output-format", default="png", choices=list(OUTPUT_FORMATS),
+        help="Image format to save. jpeg/webp are much smaller than png."
+    )
+    parser.add_argument(
+        "--output-compression", type=int, default=None,
+        help="Compression level 0-100 for jpeg/webp (default 100, as upstream)."
+    )
+    parser.add_argument(
+        "--reencode", action="store_true",
+        help="Request PNG from the API and convert to --output-format locally\n"
+             "(requires Pillow)."
+    )
+
+    # --- Latency Arguments ---
+    parser.add_argument(
+        "--deadline", type=float, default=None,
+        help="Hard per-request deadline in seconds. The call is abandoned\n"
+             "(no images saved) if it has not completed in time."
+    )
+    parser.add_argument(
+        "--hedge-after", type=float, default=None,
+        help="Fire a duplicate request if the first has not completed after\n"
+             "this many seconds, and keep whichever finishes first.\n"
+             "Can also be enabled with IMAGEGEN_HEDGE=1 (see hedging.py)."
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Capture a sampling profile of the run and write it as collapsed\n"
+             "stacks (for flame graphs) to ./profiles (see profiling.py)."
+    )
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
+    if args.profile:
+        with profile("cli_edit" if args.image else "cli_generate") as session:
+            run(args)
+        print(f"Profile written to {session.path} ({session.samples} samples, {session.duration:.1f}s)")
+    else:
+        run(args)
+
+
+def run(args: argparse.Namespace) -> None:
     prompt = " ".join(args.prompt)
     images = None # Initialize images to None
 
+    if args.deadline is not None and not (math.isfinite(args.deadline) and args.deadline > 0):
+        print("Error: --deadline must be a positive number of seconds.", file=sys.stderr)
+        sys.exit(1)
+    if args.hedge_after is not None and not (math.isfinite(args.hedge_after) and args.hedge_after >= 0):
+        print("Error: --hedge-after must be a non-negative number of seconds.", file=sys.stderr)
+        sys.exit(1)
+    if args.hedge_after is not None:
+        hedger.enabled = True
+        hedger.hedge_after = args.hedge_after
+
     # Decide whether to generate or edit based on --image argument
     if args.image: # args.image is now a list of paths if provided
         # --- Edit Mode ---
@@ -319,7 +434,11 @@ def main() -> None:
             quality=args.quality, # Pass user choice, function handles model compatibility
             n=args.num,
             model="gpt-image-1", # Hardcoded for now
-            input_fidelity=args.input_fidelity # Pass input fidelity parameter
+            input_fidelity=args.input_fidelity, # Pass input fidelity parameter
+            deadline=args.deadline,
+            output_format=args.output_format,
+            output_compression=args.output_compression,
+            reencode=args.reencode,
         )
     else:
         # --- Generate Mode ---
@@ -331,6 +450,10 @@ def main() -> None:
             quality=args.quality,
             n=args.num,
             moderation=args.moderation,
+            deadline=args.deadline,
+            output_format=args.output_format,
+            output_compression=args.output_compression,
+            reencode=args.reencode,
         )
 
     # --- Save Results (if any) ---
@@ -342,7 +465,7 @@ def main() -> None:
         print("-" * 20)
         for idx, img_bytes in enumerate(images, start=1):
             num_suffix = f"_{idx}" if args.num > 1 else ""
-            fname = f"{base_filename}{num_suffix}.png"
+            fname = f"{base_filename}{num_suffix}.{file_extension(args.output_format)}"
             try:
                 with open(fname, "wb") as f:
                     f.write(img_bytes)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Opt-in sampling profiler for the generate/edit paths.
+
+A profile session samples the stacks of the calling thread, plus any worker
+threads it hands work to (hedged API calls, re-encoding), every few
+milliseconds. It writes the result in collapsed-stack format ("a;b;c <count>"
+per line), which flamegraph.pl, speedscope or inferno turn into flame graphs:
+
+    flamegraph.pl profiles/<profile>.folded > profile.svg
+
+Web: send "X-Profile: 1" and "X-Admin-Token" on /generate or /edit (requires
+IMAGEGEN_PROFILING=1 and IMAGEGEN_ADMIN_TOKEN).
+CLI: python imagegen.py "..." --profile
+
+When no session is active the only cost is a thread-local lookup when work
+is handed to a worker pool.
+
+Environment variables
+---------------------
+IMAGEGEN_PROFILING=1              Honour the X-Profile header and enable /admin/profiles.
+IMAGEGEN_ADMIN_TOKEN=<secret>     Required by both; profiling stays off without it.
+IMAGEGEN_PROFILE_FOLDER=profiles  Where profiles are written.
+IMAGEGEN_PROFILE_INTERVAL=0.005   Sampling interval in seconds.
+IMAGEGEN_PROFILE_KEEP=50          Number of recent profiles kept.
+"""
+
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+PROFILE_FOLDER = os.environ.get("IMAGEGEN_PROFILE_FOLDER", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("IMAGEGEN_PROFILE_INTERVAL", 0.005))
+PROFILE_KEEP = int(os.environ.get("IMAGEGEN_PROFILE_KEEP", 50))
+PROFILE_EXTENSION = ".folded"
+
+_local = threading.local()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' separates frames and ' ' the count in collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class ProfileSession:
+    """Collects collapsed stack samples for a set of tracked threads."""
+
+    def __init__(self, name: str, interval: float = PROFILE_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self.path: Optional[str] = None
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="imagegen-profiler", daemon=True)
+        self._started = 0.0
+
+    def track_current_thread(self) -> None:
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name.replace(";", ":").replace(" ", "_")
+
+    def untrack_current_thread(self) -> None:
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, thread_name in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    stack.append(thread_name)
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self.track_current_thread()
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+
+    def write(self, folder: str) -> str:
+        """Write the collapsed stacks to ``folder`` and return the file path."""
+        os.makedirs(folder, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{self.name}_{uuid.uuid4().hex[:8]}{PROFILE_EXTENSION}"
+        path = os.path.join(folder, filename)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def current_session() -> Optional[ProfileSession]:
+    return getattr(_local, "session", None)
+
+
+def propagate(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wrap ``fn`` so that, when run on a worker thread, it is sampled as part of
+    the caller's active session. Returns ``fn`` unchanged when not profiling.
+    """
+    session = current_session()
+    if session is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        session.track_current_thread()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            session.untrack_current_thread()
+
+    return wrapper
+
+
+@contextmanager
+def profile(name: str, folder: str = PROFILE_FOLDER) -> Iterator[ProfileSession]:
+    """Profile the enclosed block; ``session.path`` is set on exit."""
+    session = ProfileSession(name)
+    _local.session = session
+    session.start()
+    try:
+        yield session
+    finally:
+        _local.session = None
+        session.stop()
+        session.path = session.write(folder)
+        prune_profiles(folder)
+
+
+def list_profiles(folder: str = PROFILE_FOLDER) -> List[Dict[str, Any]]:
+    """Recent profiles, newest first."""
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for filename in os.listdir(folder):
+        if filename.endswith(PROFILE_EXTENSION):
+            stat = os.stat(os.path.join(folder, filename))
+            profiles.append({"filename": filename, "size": stat.st_size, "created": stat.st_mtime})
+    return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+
+def prune_profiles(folder: str = PROFILE_FOLDER, keep: int = PROFILE_KEEP) -> None:
+    for old in list_profiles(folder)[keep:]:
+        try:
+            os.remove(os.path.join(folder, old["filename"]))
+        except OSError:
+            pass
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Prompt templates and off-peak pre-generation.
+
+Templates are registered in a JSON config file (IMAGEGEN_TEMPLATES_FILE,
+default "prompt_templates.json"; see prompt_templates.example.json):
+
+    {
+      "templates": {
+        "product_studio": "{product} on a white background, studio lighting"
+      },
+      "pregenerate": {
+        "off_peak": {"start": "01:00", "end": "06:00"},
+        "max_images_per_hour": 20,
+        "min_requests": 3,
+        "max_tracked": 500,
+        "jobs": [
+          {"template": "product_studio", "params": {"product": "a red sneaker"}}
+        ]
+      }
+    }
+
+The scheduler pre-generates the configured jobs plus any template/parameter
+combination requested at least ``min_requests`` times (only the ``max_tracked``
+most requested combinations are remembered), but only inside the
+off-peak window and within the hourly image budget. Results are stored in the
+output folder under a key derived from the rendered prompt and output
+options, so /generate can serve an exact match without calling the API.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, time as dtime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from image_encoding import file_extension
+
+
+class TemplateError(ValueError):
+    """Raised when a template is unknown or its parameters are incomplete."""
+
+
+def load_config(path: str) -> Dict[str, Any]:
+    """Load the template config; a missing file means no templates."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def render_prompt(templates: Dict[str, str], name: str, params: Dict[str, Any]) -> str:
+    """Render template ``name`` with ``params``."""
+    if name not in templates:
+        raise TemplateError(f"Unknown template '{name}'")
+    if not isinstance(params, dict):
+        raise TemplateError("Template params must be an object")
+    try:
+        return templates[name].format_map({k: str(v) for k, v in params.items()})
+    except KeyError as e:
+        raise TemplateError(f"Missing template parameter {e} for '{name}'")
+    except (ValueError, IndexError) as e:
+        raise TemplateError(f"Invalid template '{name}': {e}")
+
+
+def cache_key(
+    prompt: str,
+    size: str,
+    quality: str,
+    n: int,
+    output_format: str = "png",
+    output_compression: Optional[int] = None,
+) -> str:
+    """Key identifying an exact generate request for the pre-generated store."""
+    raw = json.dumps([prompt, size, quality, n, output_format, output_compression])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class PregenJob(NamedTuple):
+    template: str
+    params: Tuple[Tuple[str, str], ...]  # sorted items, so jobs are hashable
+    size: str = "1024x1024"
+    quality: str = "high"
+    n: int = 1
+    output_format: str = "png"
+    output_compression: Optional[int] = None
+
+    @classmethod
+    def from_request(cls, template: str, params: Dict[str, Any], **options) -> "PregenJob":
+        return cls(template, tuple(sorted((k, str(v)) for k, v in params.items())), **options)
+
+    def prompt(self, templates: Dict[str, str]) -> str:
+        return render_prompt(templates, self.template, dict(self.params))
+
+    def key(self, templates: Dict[str, str]) -> str:
+        return cache_key(
+            self.prompt(templates), self.size, self.quality, self.n,
+            self.output_format, self.output_compression,
+        )
+
+
+class PregenStore:
+    """Pre-generated images kept in the output folder as pregen_<key>_<i>.<ext>."""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def _filenames(self, key: str, n: int, output_format: str) -> List[str]:
+        ext = file_extension(output_format)
+        return [f"pregen_{key}_{i}.{ext}" for i in range(n)]
+
+    def lookup(self, key: str, n: int, output_format: str) -> Optional[List[str]]:
+        """Return the stored filenames for ``key``, or None if not (fully) stored."""
+        filenames = self._filenames(key, n, output_format)
+        if all(os.path.exists(os.path.join(self.folder, f)) for f in filenames):
+            return filenames
+        return None
+
+    def save(self, key: str, images: List[bytes], output_format: str) -> List[str]:
+        filenames = self._filenames(key, len(images), output_format)
+        for filename, image_bytes in zip(filenames, images):
+            filepath = os.path.join(self.folder, filename)
+            # Write then rename so a concurrent lookup never sees a partial file
+            with open(filepath + ".tmp", "wb") as f:
+                f.write(image_bytes)
+            os.replace(filepath + ".tmp", filepath)
+        return filenames
+
+
+def _parse_clock(value: str) -> dtime:
+    hours, minutes = value.split(":")
+    return dtime(int(hours), int(minutes))
+
+
+class OffPeakWindow:
+    """Daily local-time window; ``end`` before ``start`` wraps past midnight."""
+
+    def __init__(self, start: str = "01:00", end: str = "06:00"):
+        self.start = _parse_clock(start)
+        self.end = _parse_clock(end)
+
+    def contains(self, now: Optional[datetime] = None) -> bool:
+        current = (now or datetime.now()).time()
+        if self.start <= self.end:
+            return self.start <= current < self.end
+        return current >= self.start or current < self.end
+
+
+class PregenScheduler:
+    """
+    Pre-generate popular template requests during the off-peak window.
+
+    Parameters
+    ----------
+    templates : dict
+        Template name -> format string.
+    store : PregenStore
+        Where results are written.
+    generate : callable
+        ``imagegen.generate_image``-compatible function returning a list of
+        image bytes, or None on failure.
+    window : OffPeakWindow
+        When pre-generation may run.
+    max_images_per_hour : int
+        Off-peak rate budget, counted in generated images.
+    min_requests : int
+        Requests needed before a combination counts as popular.
+    max_tracked : int
+        Upper bound on remembered combinations; beyond it only the most
+        requested half is kept, so client-chosen params cannot grow memory.
+    jobs : list of PregenJob
+        Combinations that are always pre-generated.
+    """
+
+    def __init__(
+        self,
+        templates: Dict[str, str],
+        store: PregenStore,
+        generate: Callable[..., Optional[List[bytes]]],
+        window: OffPeakWindow,
+        max_images_per_hour: int = 20,
+        min_requests: int = 3,
+        max_tracked: int = 500,
+        jobs: Optional[List[PregenJob]] = None,
+        poll_interval: float = 60.0,
+    ):
+        self.templates = templates
+        self.store = store
+        self.generate = generate
+        self.window = window
+        self.max_images_per_hour = max_images_per_hour
+        self.min_requests = min_requests
+        self.max_tracked = max_tracked
+        self.jobs = list(jobs or [])
+        self.poll_interval = poll_interval
+        self._popularity: Counter = Counter()
+        self._failed: Counter = Counter()
+        self._generated = deque()  # (timestamp, image count) within the last hour
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], store: PregenStore, generate) -> "PregenScheduler":
+        pregen = config.get("pregenerate", {})
+        off_peak = pregen.get("off_peak", {})
+        jobs = [
+            PregenJob.from_request(
+                job["template"], job.get("params", {}),
+                **{k: job[k] for k in PregenJob._fields[2:] if k in job},
+            )
+            for job in pregen.get("jobs", [])
+        ]
+        return cls(
+            templates=config.get("templates", {}),
+            store=store,
+            generate=generate,
+            window=OffPeakWindow(off_peak.get("start", "01:00"), off_peak.get("end", "06:00")),
+            max_images_per_hour=int(pregen.get("max_images_per_hour", 20)),
+            min_requests=int(pregen.get("min_requests", 3)),
+            max_tracked=int(pregen.get("max_tracked", 500)),
+            jobs=jobs,
+        )
+
+    def record(self, job: PregenJob) -> None:
+        """Count a live request for a template combination."""
+        with self._lock:
+            self._popularity[job] += 1
+            if len(self._popularity) > self.max_tracked:
+                self._popularity = Counter(dict(self._popularity.most_common(self.max_tracked // 2)))
+
+    def budget_remaining(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._generated and self._generated[0][0] <= now - 3600:
+                self._generated.popleft()
+            return self.max_images_per_hour - sum(count for _, count in self._generated)
+
+    def pending_jobs(self) -> List[PregenJob]:
+        """Configured jobs first, then popular combinations by request count."""
+        with self._lock:
+            popular = [job for job, count in self._popularity.most_common() if count >= self.min_requests]
+            failed = dict(self._failed)
+        pending, finished = [], []
+        for job in self.jobs + popular:
+            if job in pending:
+                continue
+            if failed.get(job, 0) >= 3:
+                finished.append(job)
+                continue
+            try:
+                key = job.key(self.templates)
+            except TemplateError:
+                finished.append(job)
+                continue
+            if self.store.lookup(key, job.n, job.output_format) is None:
+                pending.append(job)
+            else:
+                finished.append(job)
+        # Stored, failed or unrenderable combinations need no more tracking
+        with self._lock:
+            for job in finished:
+                self._popularity.pop(job, None)
+        return pending
+
+    def run_once(self, now: Optional[datetime] = None) -> bool:
+        """Pre-generate at most one job; returns True if a job was attempted."""
+        if not self.window.contains(now):
+            return False
+        budget = self.budget_remaining()
+        job = next((j for j in self.pending_jobs() if j.n <= budget), None)
+        if job is None:
+            return False
+
+        with self._lock:
+            self._generated.append((time.time(), job.n))
+        images = self.generate(
+            prompt=job.prompt(self.templates),
+            size=job.size,
+            quality=job.quality,
+            n=job.n,
+            output_format=job.output_format,
+            output_compression=job.output_compression,
+        )
+        if not images:
+            with self._lock:
+                self._failed[job] += 1
+            print(f"Pre-generation failed for template '{job.template}'", file=sys.stderr)
+            return True
+        self.store.save(job.key(self.templates), images, job.output_format)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                print(f"Pre-generation scheduler error: {e}", file=sys.stderr)
+            time.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        """Start the scheduler on a daemon thread (no-op if already running)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="imagegen-pregen", daemon=True)
+            self._thread.start()